@@ -4,11 +4,21 @@ Quick Setup Script for dbt + Google Cloud + Looker
 This script helps you quickly configure your project with real values.
 """
 
+import argparse
 import os
+import re
 import sys
 from pathlib import Path
 
 
+# profiles.yml placeholders, plus the hard-coded values older copies shipped with
+PLACEHOLDER_PATTERN = re.compile(
+    r"(?P<project_id>\$\{project_id\}|your-gcp-project-id)"
+    r"|(?P<key_file>\$\{key_file\}"
+    r"|/Users/nezamsp8/Developer/python/dataEngineeringPractice/dbt-service-account-key\.json)"
+)
+
+
 def update_profiles_yml(project_id, key_file_path):
     """Update the profiles.yml file with actual values"""
     profiles_file = Path("/Users/nezamsp8/.dbt/profiles.yml")
@@ -17,20 +27,12 @@ def update_profiles_yml(project_id, key_file_path):
         print("❌ profiles.yml not found!")
         return False
 
-    # Read current content
-    with open(profiles_file, "r") as f:
-        content = f.read()
-
-    # Replace placeholders
-    content = content.replace("your-gcp-project-id", project_id)
-    content = content.replace(
-        "/Users/nezamsp8/Developer/python/dataEngineeringPractice/dbt-service-account-key.json",
-        key_file_path,
+    # Fill in every placeholder in a single pass
+    values = {"project_id": project_id, "key_file": key_file_path}
+    content = PLACEHOLDER_PATTERN.sub(
+        lambda m: values[m.lastgroup], profiles_file.read_text()
     )
-
-    # Write updated content
-    with open(profiles_file, "w") as f:
-        f.write(content)
+    profiles_file.write_text(content)
 
     print(f"✅ Updated profiles.yml with:")
     print(f"   Project ID: {project_id}")
@@ -39,23 +41,51 @@ def update_profiles_yml(project_id, key_file_path):
     return True
 
 
-def main():
+def parse_args(argv=None):
+    """Parse command-line options, falling back to environment variables"""
+    parser = argparse.ArgumentParser(description="Configure dbt profiles.yml")
+    parser.add_argument(
+        "--project-id",
+        default=os.environ.get("GCP_PROJECT_ID"),
+        help="Google Cloud project ID (env: GCP_PROJECT_ID)",
+    )
+    parser.add_argument(
+        "--key-file",
+        default=os.environ.get("GCP_KEY_FILE"),
+        help="Path to the service account key file (env: GCP_KEY_FILE)",
+    )
+    return parser.parse_args(argv)
+
+
+def prompt(message):
+    """Ask the user for a value, or return '' when not attached to a terminal"""
+    if not sys.stdin.isatty():
+        return ""
+    return input(message).strip()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
     print("🔧 Quick Configuration Setup")
     print("=" * 40)
 
     # Get project ID
-    project_id = input("Enter your Google Cloud Project ID: ").strip()
+    project_id = args.project_id or prompt("Enter your Google Cloud Project ID: ")
     if not project_id:
         print("❌ Project ID is required!")
         return False
 
     # Get key file path
-    key_file = input(
+    key_file = args.key_file or prompt(
         "Enter path to your service account key file (or press Enter for default): "
-    ).strip()
+    )
     if not key_file:
         key_file = "/Users/nezamsp8/Developer/python/dataEngineeringPractice/dbt-service-account-key.json"
 
+    # profiles.yml needs an absolute path; dbt may run from another directory
+    key_file = str(Path(key_file).expanduser().resolve())
+
     # Check if key file exists
     if not Path(key_file).exists():
         print(f"❌ Key file not found: {key_file}")
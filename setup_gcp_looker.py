@@ -4,12 +4,43 @@ Google Cloud Platform and Looker Setup Script for Healthcare dbt Project
 This script helps configure your dbt project to work with Google Cloud BigQuery and Looker Studio.
 """
 
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import functools
+import hashlib
 import os
+import re
 import json
 import subprocess
 import sys
+import tempfile
+import time
+from collections import namedtuple
 from pathlib import Path
 
+from subprocess_env import SLIM_ENV
+
+
+HERE = Path(__file__).resolve().parent
+KEY_FILE = HERE / "dbt-service-account-key.json"
+PROFILES_FILE = HERE / "profiles.yml"
+PROJECT_DIR = HERE / "my_project"
+
+# profiles.yml placeholders, plus the hard-coded values older copies shipped with
+PLACEHOLDER_PATTERN = re.compile(
+    r"(?P<project_id>\$\{project_id\}|your-gcp-project-id)"
+    r"|(?P<key_file>\$\{key_file\}"
+    r"|/Users/nezamsp8/Developer/python/dataEngineeringPractice/dbt-service-account-key\.json)"
+)
+
+GCLOUD_CACHE_DIR = Path.home() / ".cache" / "healthcare_pipeline"
+GCLOUD_CACHE_TTL = 15 * 60  # seconds
+
+GCloudEnv = namedtuple("GCloudEnv", "installed version account")
+
 
 def print_step(step_num, title):
     """Print a formatted step header"""
@@ -18,21 +49,128 @@ def print_step(step_num, title):
     print(f"{'='*60}")
 
 
-def check_gcloud_installed():
-    """Check if gcloud CLI is installed"""
+def _gcloud_cache_paths():
+    """Locate the probe cache and config file for the active gcloud configuration"""
+    if os.environ.get("CLOUDSDK_CONFIG"):
+        config_dir = Path(os.environ["CLOUDSDK_CONFIG"])
+    elif os.name == "nt" and os.environ.get("APPDATA"):
+        config_dir = Path(os.environ["APPDATA"]) / "gcloud"
+    else:
+        config_dir = Path.home() / ".config" / "gcloud"
+
+    config_name = os.environ.get("CLOUDSDK_ACTIVE_CONFIG_NAME")
+    if not config_name:
+        try:
+            config_name = (config_dir / "active_config").read_text().strip()
+        except OSError:
+            config_name = "default"
+
+    key = hashlib.blake2b(
+        f"{config_dir.resolve()}\0{config_name}".encode(), digest_size=8
+    ).hexdigest()
+    config_file = config_dir / "configurations" / f"config_{config_name}"
+    return GCLOUD_CACHE_DIR / f"gcloud-{key}.json", config_file
+
+
+@functools.lru_cache(maxsize=1)
+def _gcloud_env():
+    """Probe the gcloud CLI once, reusing a recent result cached on disk"""
+    cache_file, config_file = _gcloud_cache_paths()
     try:
-        subprocess.run(["gcloud", "--version"], capture_output=True, check=True)
-        return True
+        cached_at = cache_file.stat().st_mtime
+        try:
+            config_changed = config_file.stat().st_mtime > cached_at
+        except OSError:
+            config_changed = False
+        if time.time() - cached_at < GCLOUD_CACHE_TTL and not config_changed:
+            return GCloudEnv(**json.loads(cache_file.read_text()))
+    except (OSError, ValueError, TypeError):
+        pass
+
+    try:
+        result = subprocess.run(
+            ["gcloud", "--version"],
+            capture_output=True,
+            text=True,
+            check=True,
+            stdin=subprocess.DEVNULL,
+            env=SLIM_ENV,
+        )
+        version = result.stdout.partition("\n")[0]
     except (subprocess.CalledProcessError, FileNotFoundError):
-        return False
+        return GCloudEnv(installed=False, version=None, account=None)
+
+    try:
+        result = subprocess.run(
+            [
+                "gcloud",
+                "auth",
+                "list",
+                "--filter=status:ACTIVE",
+                "--format=value(account)",
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+            stdin=subprocess.DEVNULL,
+            env=SLIM_ENV,
+        )
+        account = result.stdout.strip() or None
+    except subprocess.CalledProcessError:
+        account = None
 
+    env = GCloudEnv(installed=True, version=version, account=account)
+
+    # Only persist a complete probe so a later `gcloud auth login` is picked up
+    if account:
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            cache_file.write_text(json.dumps(env._asdict()))
+        except OSError:
+            pass
 
-def get_project_info():
+    return env
+
+
+def check_gcloud_installed():
+    """Check if gcloud CLI is installed"""
+    return _gcloud_env().installed
+
+
+def parse_args(argv=None):
+    """Parse command-line options, falling back to environment variables"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--project-id",
+        default=os.environ.get("GCP_PROJECT_ID"),
+        help="Google Cloud project ID (env: GCP_PROJECT_ID)",
+    )
+    parser.add_argument(
+        "--key-file",
+        default=os.environ.get("GCP_KEY_FILE"),
+        help="Where to write the service account key (env: GCP_KEY_FILE)",
+    )
+    parser.add_argument(
+        "--service-account-name",
+        default=os.environ.get("GCP_SERVICE_ACCOUNT_NAME", "dbt-healthcare-service"),
+        help="Service account to create for dbt (env: GCP_SERVICE_ACCOUNT_NAME)",
+    )
+    return parser.parse_args(argv)
+
+
+def prompt(message):
+    """Ask the user for a value, or return '' when not attached to a terminal"""
+    if not sys.stdin.isatty():
+        return ""
+    return input(message).strip()
+
+
+def get_project_info(project_id=None):
     """Get Google Cloud project information from user"""
     print("\n📋 Google Cloud Project Setup")
     print("-" * 40)
 
-    project_id = input("Enter your Google Cloud Project ID: ").strip()
+    project_id = project_id or prompt("Enter your Google Cloud Project ID: ")
     if not project_id:
         print("❌ Project ID is required!")
         return None, None
@@ -44,6 +182,8 @@ def get_project_info():
             capture_output=True,
             text=True,
             check=True,
+            stdin=subprocess.DEVNULL,
+            env=SLIM_ENV,
         )
         print(f"✅ Project '{project_id}' found!")
     except subprocess.CalledProcessError:
@@ -51,76 +191,95 @@ def get_project_info():
         return None, None
 
     # Get current user email for IAM setup
-    try:
-        result = subprocess.run(
-            [
-                "gcloud",
-                "auth",
-                "list",
-                "--filter=status:ACTIVE",
-                "--format=value(account)",
-            ],
-            capture_output=True,
-            text=True,
-            check=True,
-        )
-        user_email = result.stdout.strip()
+    user_email = _gcloud_env().account
+    if user_email:
         print(f"✅ Active user: {user_email}")
-    except subprocess.CalledProcessError:
-        user_email = input("Enter your Google account email: ").strip()
+    else:
+        user_email = prompt("Enter your Google account email: ")
 
     return project_id, user_email
 
 
-def setup_bigquery_datasets(project_id):
+def setup_bigquery_datasets(project_id, credentials):
     """Create BigQuery datasets"""
     print_step(2, "Setting up BigQuery Datasets")
 
+    from google.api_core.exceptions import Conflict, GoogleAPIError
+    from google.cloud import bigquery
+
     datasets = ["healthcare_data_dev", "healthcare_data_prod"]
 
+    client = bigquery.Client(project=project_id, credentials=credentials)
+
     for dataset in datasets:
         try:
-            cmd = ["bq", "mk", "--dataset", f"--location=US", f"{project_id}:{dataset}"]
-            subprocess.run(cmd, check=True)
+            ds = bigquery.Dataset(f"{project_id}.{dataset}")
+            ds.location = "US"
+            client.create_dataset(ds, timeout=30)
             print(f"✅ Created dataset: {dataset}")
-        except subprocess.CalledProcessError as e:
-            if "already exists" in str(e):
-                print(f"ℹ️  Dataset {dataset} already exists")
-            else:
-                print(f"❌ Failed to create dataset {dataset}: {e}")
-                return False
+        except Conflict:
+            print(f"ℹ️  Dataset {dataset} already exists")
+        except GoogleAPIError as e:
+            print(f"❌ Failed to create dataset {dataset}: {e}")
+            return False
 
     return True
 
 
-def create_service_account(project_id):
+async def run_gcloud(cmd):
+    """Run a CLI command without blocking the event loop and return its stdout"""
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env=SLIM_ENV,
+    )
+    stdout, stderr = await proc.communicate()
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(
+            proc.returncode, cmd, output=stdout.decode(), stderr=stderr.decode()
+        )
+    return stdout.decode()
+
+
+async def create_service_account(project_id, service_account_name):
     """Create service account for dbt"""
     print_step(3, "Creating Service Account")
 
-    service_account_name = "dbt-healthcare-service"
     service_account_email = (
         f"{service_account_name}@{project_id}.iam.gserviceaccount.com"
     )
 
-    # Create service account
+    # Look the account up first so re-runs skip the create call entirely
     try:
         cmd = [
             "gcloud",
             "iam",
             "service-accounts",
-            "create",
-            service_account_name,
-            "--display-name=dbt Healthcare Service Account",
-            "--description=Service account for dbt healthcare data pipeline",
+            "describe",
+            service_account_email,
             f"--project={project_id}",
         ]
-        subprocess.run(cmd, check=True)
-        print(f"✅ Created service account: {service_account_name}")
-    except subprocess.CalledProcessError as e:
-        if "already exists" in str(e):
-            print(f"ℹ️  Service account {service_account_name} already exists")
-        else:
-            print(f"❌ Failed to create service account: {e}")
+        await run_gcloud(cmd)
+        print(f"ℹ️  Service account {service_account_name} already exists")
+    except subprocess.CalledProcessError:
+        # Create service account
+        try:
+            cmd = [
+                "gcloud",
+                "iam",
+                "service-accounts",
+                "create",
+                service_account_name,
+                "--display-name=dbt Healthcare Service Account",
+                "--description=Service account for dbt healthcare data pipeline",
+                f"--project={project_id}",
+            ]
+            await run_gcloud(cmd)
+            print(f"✅ Created service account: {service_account_name}")
+        except subprocess.CalledProcessError as e:
+            print(f"❌ Failed to create service account: {e.stderr.strip() or e}")
             return None
 
     # Assign roles
@@ -131,72 +290,128 @@ def create_service_account(project_id):
         "roles/bigquery.connectionUser",
     ]
 
-    for role in roles:
+    member = f"serviceAccount:{service_account_email}"
+
+    # Fetch the policy once, add every binding locally, then write it back in a
+    # single call instead of one read-modify-write round-trip per role
+    try:
+        policy = json.loads(
+            await run_gcloud(
+                ["gcloud", "projects", "get-iam-policy", project_id, "--format=json"]
+            )
+        )
+        bindings = policy.setdefault("bindings", [])
+
+        # Only merge into unconditional bindings; membership of a conditional
+        # binding grants the role just while its condition holds
+        added = []
+        for role in roles:
+            binding = next(
+                (
+                    b
+                    for b in bindings
+                    if b.get("role") == role and "condition" not in b
+                ),
+                None,
+            )
+            if binding is None:
+                bindings.append({"role": role, "members": [member]})
+                added.append(role)
+            elif member not in binding.setdefault("members", []):
+                binding["members"].append(member)
+                added.append(role)
+
+        if not added:
+            print("ℹ️  All roles already assigned")
+            return service_account_email
+
+        with tempfile.NamedTemporaryFile(
+            "w", suffix=".json", delete=False
+        ) as policy_file:
+            json.dump(policy, policy_file)
+
         try:
             cmd = [
                 "gcloud",
                 "projects",
-                "add-iam-policy-binding",
+                "set-iam-policy",
                 project_id,
-                f"--member=serviceAccount:{service_account_email}",
-                f"--role={role}",
+                policy_file.name,
             ]
-            subprocess.run(cmd, check=True)
+            await run_gcloud(cmd)
+        finally:
+            os.unlink(policy_file.name)
+
+        for role in added:
             print(f"✅ Assigned role: {role}")
-        except subprocess.CalledProcessError as e:
-            print(f"❌ Failed to assign role {role}: {e}")
+    except (subprocess.CalledProcessError, json.JSONDecodeError) as e:
+        print(f"❌ Failed to assign roles: {e}")
 
     return service_account_email
 
 
-def create_service_account_key(project_id, service_account_email):
+def create_service_account_key(
+    project_id, service_account_email, credentials, key_file=None
+):
     """Create and download service account key"""
     print_step(4, "Creating Service Account Key")
 
-    key_file = Path(__file__).parent / "dbt-service-account-key.json"
+    from google.auth.exceptions import GoogleAuthError
+    from googleapiclient import discovery
+    from googleapiclient.errors import HttpError
+
+    # profiles.yml needs an absolute path; dbt may run from another directory
+    key_file = Path(key_file).expanduser().resolve() if key_file else KEY_FILE
 
     try:
-        cmd = [
-            "gcloud",
-            "iam",
-            "service-accounts",
-            "keys",
-            "create",
-            str(key_file),
-            f"--iam-account={service_account_email}",
-        ]
-        subprocess.run(cmd, check=True)
-        print(f"✅ Created service account key: {key_file}")
-        return str(key_file)
-    except subprocess.CalledProcessError as e:
+        iam = discovery.build(
+            "iam", "v1", credentials=credentials, cache_discovery=False
+        )
+        keys = iam.projects().serviceAccounts().keys()
+        key = keys.create(
+            name=f"projects/{project_id}/serviceAccounts/{service_account_email}",
+            body={},
+        ).execute()
+    except (HttpError, GoogleAuthError) as e:
         print(f"❌ Failed to create service account key: {e}")
         return None
 
+    # Create the file owner-only from the start rather than chmod-ing it later
+    try:
+        key_file.unlink(missing_ok=True)
+        fd = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(base64.b64decode(key["privateKeyData"]))
+    except OSError as e:
+        print(f"❌ Failed to write service account key to {key_file}: {e}")
+        # Don't leave a live key behind; accounts are limited to 10 keys
+        try:
+            keys.delete(name=key["name"]).execute()
+            print("ℹ️  Deleted the unused key from Google Cloud")
+        except (HttpError, GoogleAuthError) as delete_error:
+            print(f"⚠️  Could not delete key {key['name']}: {delete_error}")
+        return None
+
+    print(f"✅ Created service account key: {key_file}")
+    return str(key_file)
+
 
 def update_profiles_yml(project_id, key_file_path):
     """Update dbt profiles.yml with project configuration"""
     print_step(5, "Updating dbt Configuration")
 
-    profiles_file = Path(__file__).parent / "profiles.yml"
+    profiles_file = PROFILES_FILE
 
     if not profiles_file.exists():
         print(f"❌ profiles.yml not found at {profiles_file}")
         return False
 
-    # Read current profiles.yml
-    with open(profiles_file, "r") as f:
-        content = f.read()
-
-    # Replace placeholders
-    content = content.replace("your-gcp-project-id", project_id)
-    content = content.replace(
-        "/Users/nezamsp8/Developer/python/dataEngineeringPractice/dbt-service-account-key.json",
-        key_file_path,
+    # Fill in every placeholder in a single pass
+    values = {"project_id": project_id, "key_file": key_file_path}
+    content = PLACEHOLDER_PATTERN.sub(
+        lambda m: values[m.lastgroup], profiles_file.read_text()
     )
-
-    # Write updated content
-    with open(profiles_file, "w") as f:
-        f.write(content)
+    profiles_file.write_text(content)
 
     print(f"✅ Updated profiles.yml with project ID: {project_id}")
     print(f"✅ Updated key file path: {key_file_path}")
@@ -208,7 +423,7 @@ def test_dbt_connection():
     """Test dbt connection to BigQuery"""
     print_step(6, "Testing dbt Connection")
 
-    project_dir = Path(__file__).parent / "my_project"
+    project_dir = PROJECT_DIR
 
     if not project_dir.exists():
         print(f"❌ dbt project directory not found: {project_dir}")
@@ -217,7 +432,14 @@ def test_dbt_connection():
     try:
         # Test connection
         cmd = ["dbt", "debug", "--project-dir", str(project_dir)]
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        result = subprocess.run(
+            cmd,
+            capture_output=True,
+            text=True,
+            check=True,
+            stdin=subprocess.DEVNULL,
+            env=SLIM_ENV,
+        )
         print("✅ dbt connection test successful!")
         print("Connection details:")
         print(result.stdout)
@@ -265,8 +487,18 @@ def setup_looker_instructions():
     )
 
 
-def main():
+async def provision_project(project_id, credentials, service_account_name):
+    """Create the BigQuery datasets and the service account in parallel"""
+    return await asyncio.gather(
+        asyncio.to_thread(setup_bigquery_datasets, project_id, credentials),
+        create_service_account(project_id, service_account_name),
+    )
+
+
+def main(argv=None):
     """Main setup function"""
+    args = parse_args(argv)
+
     print("🏥 Healthcare dbt + Google Cloud + Looker Setup")
     print("=" * 60)
 
@@ -277,21 +509,34 @@ def main():
         return False
 
     # Get project information
-    project_id, user_email = get_project_info()
+    project_id, user_email = get_project_info(args.project_id)
     if not project_id:
         return False
 
-    # Setup BigQuery datasets
-    if not setup_bigquery_datasets(project_id):
+    # Google client libraries are imported only once the setup needs them
+    import google.auth
+    from google.auth.exceptions import DefaultCredentialsError
+
+    # Authenticate once and reuse the credentials for every API client
+    try:
+        credentials, _ = google.auth.default()
+    except DefaultCredentialsError:
+        print("❌ Application Default Credentials not found!")
+        print("Please run: gcloud auth application-default login")
         return False
 
-    # Create service account
-    service_account_email = create_service_account(project_id)
-    if not service_account_email:
+    # Setup BigQuery datasets and create the service account concurrently;
+    # both only depend on the project ID
+    datasets_ok, service_account_email = asyncio.run(
+        provision_project(project_id, credentials, args.service_account_name)
+    )
+    if not datasets_ok or not service_account_email:
         return False
 
     # Create service account key
-    key_file = create_service_account_key(project_id, service_account_email)
+    key_file = create_service_account_key(
+        project_id, service_account_email, credentials, args.key_file
+    )
     if not key_file:
         return False
 
@@ -4,42 +4,104 @@ Healthcare Data Pipeline Setup Script
 This script helps set up and run the healthcare data pipeline with dbt and Google Cloud.
 """
 
+from __future__ import annotations
+
+import functools
+import hashlib
+import importlib.util
 import os
 import subprocess
 import sys
-import requests
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from subprocess_env import SLIM_ENV
+
+# Modules provided by requirements.txt
+REQUIRED_MODULES = (
+    "dbt.adapters.bigquery",
+    "google.api_core",
+    "google.auth",
+    "google.cloud.bigquery",
+    "googleapiclient",
+    "requests",
+)
+
+# dbt-generated directories that never feed into the generated docs
+PROJECT_OUTPUT_DIRS = {"target", "dbt_packages", "logs"}
+
+
+def module_available(name):
+    """Check whether a module can be imported without importing it."""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except ModuleNotFoundError:
+        return False
+
 
 def run_command(command, description):
-    """Run a shell command and handle errors."""
+    """Run a command (argument list), streaming its output; return True on success."""
     print(f"🔄 {description}...")
     try:
-        result = subprocess.run(
-            command, shell=True, check=True, capture_output=True, text=True
-        )
-        print(f"✅ {description} completed successfully")
-        return result.stdout
-    except subprocess.CalledProcessError as e:
-        print(f"❌ {description} failed: {e.stderr}")
-        return None
+        with subprocess.Popen(
+            command,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1,
+            env=SLIM_ENV,
+        ) as process:
+            for line in process.stdout:
+                sys.stdout.write(line)
+            returncode = process.wait()
+    except FileNotFoundError:
+        print(f"❌ {description} failed: {command[0]} not found")
+        return False
 
+    if returncode != 0:
+        print(f"❌ {description} failed with exit code {returncode}")
+        return False
 
-def download_csv_from_github(repo_url, file_path, local_path):
+    print(f"✅ {description} completed successfully")
+    return True
+
+
+@functools.lru_cache(maxsize=1)
+def get_session():
+    """Shared HTTP session so concurrent downloads reuse pooled TLS connections."""
+    # Imported here so runs that never download skip loading requests
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=8))
+    return session
+
+
+def download_csv_from_github(session, repo_url, file_path, local_path):
     """Download a CSV file from a GitHub repository."""
+    # Download next to the target and move it into place once complete, so an
+    # interrupted transfer never leaves a truncated CSV at local_path
+    partial_path = Path(f"{local_path}.part")
     try:
         print(f"📥 Downloading {file_path} from {repo_url}...")
-        response = requests.get(f"{repo_url}/raw/main/{file_path}")
-        response.raise_for_status()
-
-        # Ensure the seeds directory exists
-        os.makedirs(os.path.dirname(local_path), exist_ok=True)
-
-        with open(local_path, "w") as f:
-            f.write(response.text)
+        url = f"{repo_url}/raw/main/{file_path}"
+        with session.get(url, stream=True, timeout=30) as response:
+            response.raise_for_status()
+
+            # Ensure the seeds directory exists
+            partial_path.parent.mkdir(parents=True, exist_ok=True)
+
+            # Copy the raw bytes straight to disk without decoding to str
+            with open(partial_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=1 << 20):
+                    f.write(chunk)
+        os.replace(partial_path, local_path)
         print(f"✅ Downloaded {file_path} to {local_path}")
         return True
     except Exception as e:
+        partial_path.unlink(missing_ok=True)
         print(f"❌ Failed to download {file_path}: {e}")
         return False
 
@@ -54,52 +116,80 @@ def setup_environment():
     ):
         print("⚠️  Warning: You're not in a virtual environment. Consider using one.")
 
-    # Install dbt-bigquery
-    run_command("pip install dbt-bigquery", "Installing dbt-bigquery")
-
-    # Install requests for downloading files
-    run_command("pip install requests", "Installing requests")
+    # Install pinned dependencies in one resolver pass, only if any are missing
+    missing = [module for module in REQUIRED_MODULES if not module_available(module)]
+    if not missing:
+        print("✅ Dependencies already installed")
+        return
+
+    run_command(
+        [
+            sys.executable,
+            "-m",
+            "pip",
+            "install",
+            "--no-input",
+            "-r",
+            str(Path(__file__).parent / "requirements.txt"),
+        ],
+        f"Installing dependencies ({', '.join(missing)} missing)",
+    )
 
 
 def download_sample_data():
     """Download sample healthcare data from GitHub."""
     print("📊 Downloading sample healthcare data...")
 
-    # Example healthcare data repositories (replace with actual ones)
+    # Without a configured data repository, use the sample data shipped with
+    # the project rather than reaching out to a placeholder URL
+    repo_url = os.environ.get("HEALTHCARE_DATA_REPO_URL")
+    if not repo_url:
+        print("ℹ️  Using sample data files already created in the project")
+        return True
+
     sample_data = [
         {
-            "repo_url": "https://github.com/your-org/healthcare-data",
+            "repo_url": repo_url,
             "file_path": "data/patients.csv",
             "local_path": "my_project/seeds/patients.csv",
         },
         {
-            "repo_url": "https://github.com/your-org/healthcare-data",
+            "repo_url": repo_url,
             "file_path": "data/visits.csv",
             "local_path": "my_project/seeds/visits.csv",
         },
         {
-            "repo_url": "https://github.com/your-org/healthcare-data",
+            "repo_url": repo_url,
             "file_path": "data/lab_results.csv",
             "local_path": "my_project/seeds/lab_results.csv",
         },
     ]
 
-    # For now, we'll use the sample data we created
-    print("ℹ️  Using sample data files already created in the project")
-    return True
+    # Fetch the files concurrently over the shared session
+    session = get_session()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(
+            executor.map(
+                lambda s: download_csv_from_github(session, **s), sample_data
+            )
+        )
+
+    return all(results)
 
 
 def validate_dbt_project():
     """Validate the dbt project configuration."""
     print("🔍 Validating dbt project...")
 
+    root = Path.cwd()
+
     # Check if dbt_project.yml exists
-    if not os.path.exists("my_project/dbt_project.yml"):
+    if not root.joinpath("my_project", "dbt_project.yml").is_file():
         print("❌ dbt_project.yml not found")
         return False
 
     # Check if profiles.yml exists
-    if not os.path.exists("profiles.yml"):
+    if not root.joinpath("profiles.yml").is_file():
         print(
             "❌ profiles.yml not found. Please create it with your Google Cloud credentials."
         )
@@ -109,28 +199,92 @@ def validate_dbt_project():
     return True
 
 
-def run_dbt_pipeline():
+def project_fingerprint(project_dir, profiles_dir):
+    """Hash the dbt project files and profile that the generated docs depend on."""
+    # Everything except dbt's own output, so docs blocks, tests, snapshots,
+    # analyses and package files are covered without keeping an allow-list
+    files = [
+        path
+        for path in project_dir.rglob("*")
+        if path.is_file()
+        and path.relative_to(project_dir).parts[0] not in PROJECT_OUTPUT_DIRS
+    ]
+
+    digest = hashlib.blake2b()
+    for path in sorted(files):
+        digest.update(str(path.relative_to(project_dir)).encode())
+        digest.update(path.read_bytes())
+
+    # The profile decides which project and dataset the catalog describes
+    profiles_file = profiles_dir / "profiles.yml"
+    if profiles_file.is_file():
+        digest.update(profiles_file.read_bytes())
+    return digest.hexdigest()
+
+
+def resolve_profiles_dir(project_dir):
+    """Find profiles.yml the way dbt does when run from inside the project."""
+    if os.environ.get("DBT_PROFILES_DIR"):
+        return Path(os.environ["DBT_PROFILES_DIR"])
+    if (project_dir / "profiles.yml").is_file():
+        return project_dir
+    return Path.home() / ".dbt"
+
+
+def run_dbt_pipeline(project_dir="my_project", target=None):
     """Run the complete dbt pipeline."""
     print("🔄 Running dbt pipeline...")
 
-    # Change to the dbt project directory
-    os.chdir("my_project")
+    project_dir = Path(project_dir)
+
+    # Each named target keeps its manifest, catalog and docs hash apart
+    target_path = project_dir / "target"
+    if target:
+        target_path = target_path / target
+
+    # Point dbt at the project and profile instead of changing the process-wide
+    # cwd, which would otherwise make dbt pick up the repo-root profiles.yml
+    profiles_dir = resolve_profiles_dir(project_dir)
+    dbt_args = ["--project-dir", str(project_dir), "--profiles-dir", str(profiles_dir)]
+    if target:
+        dbt_args += ["--target", target]
+
+    # `dbt deps` does not accept --target-path, so only the commands that write
+    # artifacts get it
+    build_args = dbt_args + ["--target-path", str(target_path.resolve())]
 
     # Run dbt commands
     commands = [
-        ("dbt deps", "Installing dbt dependencies"),
-        ("dbt seed", "Loading CSV seed data"),
-        ("dbt run", "Running dbt models"),
-        ("dbt test", "Running dbt tests"),
-        ("dbt docs generate", "Generating documentation"),
+        (["dbt", "deps"] + dbt_args, "Installing dbt dependencies"),
+        (["dbt", "seed"] + build_args, "Loading CSV seed data"),
+        (["dbt", "run"] + build_args, "Running dbt models"),
+        (["dbt", "test"] + build_args, "Running dbt tests"),
     ]
 
     for command, description in commands:
-        result = run_command(command, description)
-        if result is None:
+        if not run_command(command, description):
             print(f"❌ Pipeline failed at: {description}")
             return False
 
+    # Only regenerate the docs when the project, seeds, profile or target changed
+    docs_hash_file = target_path / ".docs_hash"
+    fingerprint = project_fingerprint(project_dir, profiles_dir)
+    docs_hash = f"{target or 'default'}:{fingerprint}"
+    docs_current = (
+        (target_path / "catalog.json").is_file()
+        and docs_hash_file.is_file()
+        and docs_hash_file.read_text() == docs_hash
+    )
+    if docs_current:
+        print("ℹ️  Documentation is up to date, skipping dbt docs generate")
+    else:
+        description = "Generating documentation"
+        if not run_command(["dbt", "docs", "generate"] + build_args, description):
+            print(f"❌ Pipeline failed at: {description}")
+            return False
+        target_path.mkdir(parents=True, exist_ok=True)
+        docs_hash_file.write_text(docs_hash)
+
     print("✅ dbt pipeline completed successfully!")
     return True
 
@@ -141,7 +295,7 @@ def main():
     print("=" * 50)
 
     # Check if we're in the right directory
-    if not os.path.exists("my_project"):
+    if not Path("my_project").is_dir():
         print("❌ Please run this script from the project root directory")
         sys.exit(1)
 
@@ -152,7 +306,9 @@ def main():
         print("❌ Project validation failed. Please check your configuration.")
         sys.exit(1)
 
-    download_sample_data()
+    if not download_sample_data():
+        print("❌ Sample data download failed. Please check the errors above.")
+        sys.exit(1)
 
     if run_dbt_pipeline():
         print("\n🎉 Healthcare data pipeline setup complete!")
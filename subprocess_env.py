@@ -0,0 +1,41 @@
+"""
+Shared subprocess environment for the setup scripts
+Minimal environment passed to the gcloud, dbt and pip commands they run.
+"""
+
+import os
+
+# Enough to find binaries, credentials, CA bundles and tool config, without
+# inheriting variables that slow down the child CLI's startup
+SLIM_ENV_KEYS = (
+    "PATH",
+    "HOME",
+    "LANG",
+    "LC_ALL",
+    "TMPDIR",
+    "GOOGLE_APPLICATION_CREDENTIALS",
+    "HTTP_PROXY",
+    "HTTPS_PROXY",
+    "NO_PROXY",
+    "http_proxy",
+    "https_proxy",
+    "no_proxy",
+    # Custom CA bundles, needed behind TLS-intercepting proxies
+    "REQUESTS_CA_BUNDLE",
+    "SSL_CERT_FILE",
+    "SSL_CERT_DIR",
+    "CURL_CA_BUNDLE",
+    # Required on Windows for process startup, temp files and gcloud's config
+    "SYSTEMROOT",
+    "PATHEXT",
+    "TMP",
+    "TEMP",
+    "USERPROFILE",
+    "APPDATA",
+    "LOCALAPPDATA",
+)
+SLIM_ENV = {
+    key: value
+    for key, value in os.environ.items()
+    if key in SLIM_ENV_KEYS or key.startswith(("CLOUDSDK_", "DBT_", "PIP_"))
+}